@@ -1 +1,6 @@
 from .amigocloud import AmigoCloud, AmigoCloudError
+from .spatial import SpatialIndex
+from .geometry import GeometryArray, decode_geometries, decode_rows
+from .profiling import PhaseTimer
+from .hedging import HedgingPolicy
+from .pool import AmigoCloudPool
@@ -5,11 +5,16 @@ import urllib
 from datetime import datetime
 
 import gevent
+import gevent.threadpool
 import requests
 from six import string_types
 from six.moves.urllib.parse import urlparse, urlunparse, parse_qs
 from socketIO_client import SocketIO, BaseNamespace
 
+from .profiling import NULL_TIMER
+from .spatial import (SpatialIndex, TILE_BBOX_COLUMNS, split_extent,
+                      tile_query)
+
 # Disable useless warnings
 # Works with requests==2.6.0, fails with some other versions
 try:
@@ -20,6 +25,7 @@ except AttributeError:
 BASE_URL = 'https://app.amigocloud.com'
 CHUNK_SIZE = 100000  # 100kB
 MAX_SIZE_SIMPLE_UPLOAD = 8000000  # 8MB
+SQL_PAGE_SIZE = 1000
 
 
 class AmigoCloudError(Exception):
@@ -39,8 +45,12 @@ class AmigoCloudIterator(object):
     iter_num = 0
     new_list_lenght = 0
 
-    def __init__(self, first_url, params=None, **request_kwargs):
+    def __init__(self, first_url, params=None, timer=NULL_TIMER,
+                 hedging=None, session=requests, **request_kwargs):
         self.params = params
+        self.timer = timer
+        self.hedging = hedging
+        self.session = session
         self.request_kwargs = request_kwargs
         self.is_iterable = True
         self.next_url = None
@@ -50,8 +60,17 @@ class AmigoCloudIterator(object):
         """
         Request URL and check if it is an iterable object or is a simple object.
         """
-        response = requests.get(url, params=self.params, **self.request_kwargs)
-        json_response = json.loads(response.text)
+        def request():
+            return self.session.get(url, params=self.params,
+                                    **self.request_kwargs)
+
+        with self.timer.phase('network'):
+            if self.hedging:
+                response = self.hedging.send(request)
+            else:
+                response = request()
+        with self.timer.phase('json decode'):
+            json_response = json.loads(response.text)
 
         if first_request and 'next' not in json_response:
             self.is_iterable = False
@@ -118,6 +137,27 @@ class AmigoCloudIterator(object):
     def next(self):
         return self.__next__()
 
+    def next_page(self):
+        """
+        Return the remaining items of the current page as a list and move to
+        the next page. Useful to process a whole page at once.
+        """
+        if not self.has_next:
+            raise StopIteration
+
+        page = self.data[self.iter_num:]
+        self.iter_num = self.new_list_lenght
+        if self.next_url:
+            self.process_values(self.next_url)
+        return page
+
+    def pages(self):
+        """
+        Iterate over the remaining pages instead of the items.
+        """
+        while self.has_next:
+            yield self.next_page()
+
 
     def __iter__(self):
         return self
@@ -136,7 +176,8 @@ class AmigoCloud(object):
     }
 
     def __init__(self, token=None, project_url=None, base_url=BASE_URL,
-                 use_websockets=True, websocket_port=None):
+                 use_websockets=True, websocket_port=None, timer=None,
+                 hedging=None, session=None):
         """
         :param str token: AmigoCloud API Token
         :param str project_url: Specify it if you are using a project token
@@ -144,7 +185,17 @@ class AmigoCloud(object):
         :param bool use_websockets: True by default. Parameter will be ignored
             when using Project Tokens
         :param int websocket_port: Standard websocket port by default
+        :param PhaseTimer timer: Records the time spent waiting for the
+            network and decoding JSON. Disabled by default
+        :param HedgingPolicy hedging: Hedge GET requests (not streamed) to
+            reduce tail latency. Disabled by default
+        :param requests.Session session: Session used for the requests, to
+            share its connection pool. By default no session is used
         """
+        self.timer = timer or NULL_TIMER
+        self.hedging = hedging
+        self.session = session or requests
+
         # Urls
         if base_url.endswith('/'):
             self.base_url = base_url[:-1]
@@ -214,7 +265,9 @@ class AmigoCloud(object):
         if self._token:
             params.setdefault('token', self._token)
 
-        return AmigoCloudIterator(full_url, params=params, **request_kwargs)
+        return AmigoCloudIterator(full_url, params=params, timer=self.timer,
+                                  hedging=self.hedging, session=self.session,
+                                  **request_kwargs)
 
     def get(self, url, params=None, raw=False, stream=False, **request_kwargs):
         """
@@ -228,15 +281,25 @@ class AmigoCloud(object):
         if self._token:
             params.setdefault('token', self._token)
 
-        response = requests.get(full_url, params=params, stream=stream,
-                                **request_kwargs)
+        def request():
+            return self.session.get(full_url, params=params, stream=stream,
+                                    **request_kwargs)
+
+        with self.timer.phase('network'):
+            # Streamed responses are not hedged: the discarded one would keep
+            # its connection open.
+            if self.hedging and not stream:
+                response = self.hedging.send(request)
+            else:
+                response = request()
         self.check_for_errors(response)  # Raise exception if something failed
 
         if stream:
             return response
         if raw or not response.content:
             return response.content
-        return json.loads(response.text)
+        with self.timer.phase('json decode'):
+            return json.loads(response.text)
 
     def _secure_request(self, url, method, data=None, files=None, headers=None,
                         raw=False, send_as_json=True, content_type=None,
@@ -264,14 +327,16 @@ class AmigoCloud(object):
                 headers['content-type'] = content_type
             data = data or ''
 
-        method = getattr(requests, method, None)
-        response = method(full_url, data=data, files=files, headers=headers,
-                          **request_kwargs)
+        method = getattr(self.session, method, None)
+        with self.timer.phase('network'):
+            response = method(full_url, data=data, files=files,
+                              headers=headers, **request_kwargs)
         self.check_for_errors(response)  # Raise exception if something failed
 
         if raw or not response.content:
             return response.content
-        return json.loads(response.text)
+        with self.timer.phase('json decode'):
+            return json.loads(response.text)
 
     def post(self, url, data=None, files=None, headers=None, raw=False,
              send_as_json=True, content_type=None, **request_kwargs):
@@ -472,7 +537,8 @@ class AmigoCloud(object):
         self.socketio.wait(seconds=seconds)
 
     def geocode_addresses(self, project_id, dataset_id, address_field,
-                          geometry_field, **extra_params):
+                          geometry_field, batch_size=30, workers=1,
+                          page_size=SQL_PAGE_SIZE, **extra_params):
         """
         Geocode addresses in a dataset. The dataset must have a string field
         with the addresses to geocode and a geometry field (points) for the
@@ -481,6 +547,11 @@ class AmigoCloud(object):
         :param dataset_id: Must be a string.
         :param address_field: Name of the address field in the dataset.
         :param geometry_field: Name of the geometry field in the dataset.
+        :param batch_size: Number of geocoded addresses saved per UPDATE
+                       query.
+        :param workers: Number of addresses geocoded at the same time, in
+                       threads. One by one by default.
+        :param page_size: Number of rows exported per request.
         :param extra_params: Dictionary to filter the Geocoding response.
                        For example: {'country':'PE'}
                        More information:
@@ -513,13 +584,13 @@ class AmigoCloud(object):
 
         print('Exporting addresses...')
 
-        for i in range(0, dataset_count, 1000):
+        for i in range(0, dataset_count, page_size):
             response = self.get(
                 project_query_url,
                 params={
                     'query': get_query,
                     'offset': i,
-                    'limit': 1000
+                    'limit': page_size
                 }
             )
             dataset_rows = response['data']
@@ -542,9 +613,10 @@ class AmigoCloud(object):
             address = row_data[address_field]
             amigo_id = row_data['amigo_id']
 
-            geocoder_params['text'] = address
+            # Copy the params: addresses can be geocoded from several threads
             geocoder_result = self.get(geocoder_url,
-                                       params=geocoder_params,
+                                       params=dict(geocoder_params,
+                                                   text=address),
                                        stream=True)
 
             if geocoder_result.status_code == 200:
@@ -562,33 +634,32 @@ class AmigoCloud(object):
             return ''
 
         processed = 0
-        steps = 30
-        for i in range(0, len(rows), steps):
-            rows_to_geocode = rows[i: i + steps]
-            threads = []
-
-            for row in rows_to_geocode:
-                threads.append(gevent.spawn(geocode_address,
-                                            row))
-            gevent.joinall(threads)
-            values = ''.join([thread.value for thread in threads])
-
-            if values != '':
-                data = {
-                    'query': ('UPDATE dataset_{dataset_id} as d '
-                              'SET {geo_column} = c.{geo_column} '
-                              'FROM (values {values}) '
-                              'as c(amigo_id, {geo_column}) '
-                              'WHERE c.amigo_id = d.amigo_id'
-                              ).format(dataset_id=dataset_id,
-                                       geo_column=geometry_field,
-                                       values=values[:-1])
-                }
-
-                self.post(project_query_url, data=data)
-
-            processed += len(rows_to_geocode)
-            print('%d%%' % (float(processed) / dataset_count * 100))
+        # Real threads are needed to geocode at the same time: requests are
+        # not monkey patched
+        pool = gevent.threadpool.ThreadPool(max(1, workers))
+        try:
+            for i in range(0, len(rows), batch_size):
+                rows_to_geocode = rows[i: i + batch_size]
+                values = ''.join(pool.map(geocode_address, rows_to_geocode))
+
+                if values != '':
+                    data = {
+                        'query': ('UPDATE dataset_{dataset_id} as d '
+                                  'SET {geo_column} = c.{geo_column} '
+                                  'FROM (values {values}) '
+                                  'as c(amigo_id, {geo_column}) '
+                                  'WHERE c.amigo_id = d.amigo_id'
+                                  ).format(dataset_id=dataset_id,
+                                           geo_column=geometry_field,
+                                           values=values[:-1])
+                    }
+
+                    self.post(project_query_url, data=data)
+
+                processed += len(rows_to_geocode)
+                print('%d%%' % (float(processed) / dataset_count * 100))
+        finally:
+            pool.kill()
 
         count_query = ('SELECT count(*) '
                        'FROM dataset_{dataset_id} '
@@ -607,3 +678,50 @@ class AmigoCloud(object):
         print('Total time: %s' % total_time)
         average_time = total_time.total_seconds() / dataset_count
         print('Average time per request: %.3f seconds' % average_time)
+
+    def get_spatial_index(self, project_id, dataset_id, extent,
+                          geometry_field='wkb_geometry', tiles=4, workers=8,
+                          page_size=SQL_PAGE_SIZE, srid=4326, cells=64):
+        """
+        Fetch the rows of a dataset intersecting an extent and load them in a
+        local `SpatialIndex`, so bbox and nearest neighbour lookups can be
+        done without further requests.
+        The extent is split in `tiles` x `tiles` tiles which are queried in
+        parallel. Rows straddling several tiles are only kept once (by
+        `amigo_id`).
+        :param project_id: Must be a string.
+        :param dataset_id: Must be a string.
+        :param tuple extent: `(xmin, ymin, xmax, ymax)` in `srid` coordinates.
+        :param geometry_field: Name of the geometry field in the dataset.
+        :param int tiles: Number of tiles per axis.
+        :param int workers: Number of tiles requested at the same time.
+        :param int page_size: Number of rows requested per page.
+        :param int srid: SRID of the extent coordinates.
+        :param int cells: Number of buckets per axis of the index.
+        """
+
+        project_query_url = '/projects/{project_id}/sql'.format(
+            project_id=project_id)
+
+        def fetch_tile(tile):
+            query = tile_query(dataset_id, geometry_field, tile, srid=srid)
+            # The offset of the following pages comes in the `next` link
+            return list(self.get_cursor(
+                project_query_url,
+                params={'query': query, 'limit': page_size}))
+
+        # Real threads are needed here: requests are not monkey patched
+        pool = gevent.threadpool.ThreadPool(max(1, min(workers, tiles ** 2)))
+        try:
+            results = pool.map(fetch_tile, split_extent(extent, tiles))
+        finally:
+            pool.kill()
+
+        index = SpatialIndex(extent, cells=cells)
+        for rows in results:
+            for row in rows:
+                if row['amigo_id'] in index:
+                    continue
+                bbox = tuple(row.pop(column) for column in TILE_BBOX_COLUMNS)
+                index.insert(row['amigo_id'], bbox, row)
+        return index
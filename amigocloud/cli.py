@@ -0,0 +1,230 @@
+"""
+Command line interface for bulk operations:
+
+    python -m amigocloud --help
+    amigocloud export /me/projects projects.jsonl
+    amigocloud --profile export projects/1234/sql rows.csv \
+        --query 'select * from dataset_1' --format csv --workers 4
+
+The API token is read from the AMIGOCLOUDTOKEN environment variable unless
+`--token` is given.
+"""
+from __future__ import print_function
+
+import argparse
+import cProfile
+import csv
+import json
+import os
+import sys
+
+import gevent.threadpool
+
+from .amigocloud import (AmigoCloud, AmigoCloudError, BASE_URL, CHUNK_SIZE,
+                         SQL_PAGE_SIZE)
+from .hedging import HedgingPolicy
+from .profiling import PhaseTimer
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='amigocloud',
+        description='Bulk operations with the AmigoCloud REST API.')
+    parser.add_argument('--token', default=os.getenv('AMIGOCLOUDTOKEN'),
+                        help='API token (default: $AMIGOCLOUDTOKEN)')
+    parser.add_argument('--project-url',
+                        help='Project url, when using a project token')
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--workers', type=int,
+                        help='Number of requests done at the same time '
+                             '(default: 1)')
+    parser.add_argument('--page-size', type=int, default=SQL_PAGE_SIZE,
+                        help='Number of rows requested per page')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='Size in bytes of each chunk of an upload')
+    parser.add_argument('--hedge', action='store_true',
+                        help='Hedge slow GET requests to reduce tail latency')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print the time spent in each phase')
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help='Dump cProfile stats to FILE (implies --profile). '
+                             'Only the main thread is profiled, so with '
+                             '--workers > 1 the requests done by the workers '
+                             'are not included')
+
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    export = commands.add_parser(
+        'export', help='Write all the items of a paginated url to a file')
+    export.add_argument('url')
+    export.add_argument('output', help="Output file, '-' for stdout")
+    export.add_argument('--query', help='SQL query, when url is a sql url')
+    export.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+    export.set_defaults(func=export_command)
+
+    upload = commands.add_parser('upload',
+                                 help='Upload datafiles to a project')
+    upload.add_argument('project_owner')
+    upload.add_argument('project_id')
+    upload.add_argument('files', nargs='+')
+    upload.add_argument('--force-chunked', action='store_true')
+    upload.set_defaults(func=upload_command)
+
+    geocode = commands.add_parser('geocode',
+                                  help='Geocode the addresses of a dataset')
+    geocode.add_argument('project_id')
+    geocode.add_argument('dataset_id')
+    geocode.add_argument('address_field')
+    geocode.add_argument('geometry_field')
+    geocode.add_argument('--component', action='append', default=[],
+                         metavar='KEY=VALUE',
+                         help='Geocoding filter, e.g. country=PE')
+    geocode.add_argument('--batch-size', type=int,
+                         help='Addresses saved per UPDATE query (default: 30)')
+    geocode.set_defaults(func=geocode_command)
+
+    sql = commands.add_parser('sql', help='Run a SQL query in a project')
+    sql.add_argument('project_id')
+    sql.add_argument('query')
+    sql.add_argument('--write', action='store_true',
+                     help='Send the query as a POST, needed to alter data')
+    sql.set_defaults(func=sql_command)
+
+    return parser
+
+
+def _sql_url(project_id):
+    return '/projects/{project_id}/sql'.format(project_id=project_id)
+
+
+def _export_pages(client, args):
+    """
+    Yield the pages of the export. SQL queries are paginated by offset, so
+    with more than one worker the pages are requested in parallel (and still
+    yielded in order).
+    """
+
+    if not args.query:
+        for page in client.get_cursor(args.url,
+                                      {'limit': args.page_size}).pages():
+            yield page
+        return
+
+    # The cursor follows the `next` links, which carry the offset
+    params = {'query': args.query, 'limit': args.page_size}
+    workers = args.workers or 1
+    if workers <= 1:
+        for page in client.get_cursor(args.url, params).pages():
+            yield page
+        return
+
+    first = client.get(args.url, params=dict(params, offset=0))
+    yield first['data']
+
+    def fetch(offset):
+        return client.get(args.url, params=dict(params, offset=offset))['data']
+
+    pool = gevent.threadpool.ThreadPool(workers)
+    try:
+        for page in pool.imap(fetch, range(args.page_size, first['count'],
+                                           args.page_size)):
+            yield page
+    finally:
+        pool.kill()
+
+
+def export_command(client, args, timer):
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    writer = None
+    rows = 0
+    try:
+        for page in _export_pages(client, args):
+            with timer.phase('write'):
+                for row in page:
+                    if args.format == 'jsonl':
+                        output.write(json.dumps(row) + '\n')
+                        continue
+                    if writer is None:
+                        writer = csv.DictWriter(output, fieldnames=list(row))
+                        writer.writeheader()
+                    writer.writerow(row)
+            rows += len(page)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print('%d rows exported' % rows, file=sys.stderr)
+
+
+def upload_command(client, args, timer):
+    def upload(path):
+        return path, client.upload_datafile(
+            args.project_owner, args.project_id, path,
+            chunk_size=args.chunk_size, force_chunked=args.force_chunked)
+
+    pool = gevent.threadpool.ThreadPool(args.workers or 1)
+    try:
+        for path, response in pool.imap_unordered(upload, args.files):
+            print(json.dumps({'file': path, 'response': response}))
+    finally:
+        pool.kill()
+
+
+def geocode_command(client, args, timer):
+    kwargs = dict(component.split('=', 1) for component in args.component)
+    # Keep the library defaults unless they were set
+    if args.workers:
+        kwargs['workers'] = args.workers
+    if args.batch_size:
+        kwargs['batch_size'] = args.batch_size
+    client.geocode_addresses(args.project_id, args.dataset_id,
+                             args.address_field, args.geometry_field,
+                             page_size=args.page_size, **kwargs)
+
+
+def sql_command(client, args, timer):
+    if args.write:
+        response = client.post(_sql_url(args.project_id),
+                               data={'query': args.query})
+    else:
+        response = client.get(_sql_url(args.project_id),
+                              params={'query': args.query,
+                                      'limit': args.page_size})
+    print(json.dumps(response, indent=2))
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.token:
+        parser.error('An API token is required (--token or AMIGOCLOUDTOKEN).')
+
+    profile = args.profile or args.profile_output
+    timer = PhaseTimer() if profile else None
+    profiler = cProfile.Profile() if args.profile_output else None
+    hedging = HedgingPolicy() if args.hedge else None
+
+    if profiler and (args.workers or 1) > 1:
+        print('Only the main thread is profiled: the requests done by the '
+              'workers are not in %s' % args.profile_output, file=sys.stderr)
+    if profiler:
+        profiler.enable()
+    try:
+        client = AmigoCloud(args.token, project_url=args.project_url,
+                            base_url=args.base_url, use_websockets=False,
+                            timer=timer, hedging=hedging)
+        args.func(client, args, client.timer)
+    except AmigoCloudError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile_output)
+        if timer:
+            print(timer.report(), file=sys.stderr)
+        if timer and hedging:
+            print('hedges fired: %d, won: %d, requests: %d' % (
+                hedging.hedges_fired, hedging.hedges_won, hedging.requests),
+                file=sys.stderr)
+    return 0
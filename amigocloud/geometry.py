@@ -0,0 +1,415 @@
+import binascii
+import json
+import multiprocessing
+import struct
+
+from six import string_types
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+MULTIPOINT = 4
+MULTILINESTRING = 5
+MULTIPOLYGON = 6
+GEOMETRYCOLLECTION = 7
+
+GEOMETRY_TYPES = {
+    'Point': POINT,
+    'LineString': LINESTRING,
+    'Polygon': POLYGON,
+    'MultiPoint': MULTIPOINT,
+    'MultiLineString': MULTILINESTRING,
+    'MultiPolygon': MULTIPOLYGON,
+    'GeometryCollection': GEOMETRYCOLLECTION,
+}
+GEOMETRY_NAMES = dict((code, name) for name, code in GEOMETRY_TYPES.items())
+
+# EWKB flags (PostGIS)
+EWKB_Z = 0x80000000
+EWKB_M = 0x40000000
+EWKB_SRID = 0x20000000
+
+DECODE_CHUNK_SIZE = 50000
+
+
+class GeometryArray(object):
+    """
+    Geometries of a page of rows stored as flat NumPy arrays.
+    Every geometry is a list of parts, every part a list of rings and every
+    ring a list of coordinates:
+    - `types[i]` is the geometry type of the i-th value (0 when it is null).
+    - Parts of geometry i: `geometry_offsets[i]:geometry_offsets[i + 1]`.
+    - Rings of part j: `part_offsets[j]:part_offsets[j + 1]`.
+    - Coordinates of ring k: `coords[ring_offsets[k]:ring_offsets[k + 1]]`.
+    Points and lines have one part with one ring. Only X and Y are kept.
+    Geometry collections are flattened: their members become parts of the
+    collection and the type of each member is not kept.
+    """
+
+    def __init__(self, types, coords, geometry_offsets, part_offsets,
+                 ring_offsets):
+        self.types = types
+        self.coords = coords
+        self.geometry_offsets = geometry_offsets
+        self.part_offsets = part_offsets
+        self.ring_offsets = ring_offsets
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i):
+        """
+        Return the i-th geometry as a GeoJSON like dict, or None if it is null.
+        Geometry collections are returned as
+        `{'type': 'GeometryCollection', 'coordinates': parts}`, with the
+        rings of every part but without the types of their members.
+        """
+        geometry_type = int(self.types[i])
+        if not geometry_type:
+            return None
+        parts = []
+        for part in range(self.geometry_offsets[i],
+                          self.geometry_offsets[i + 1]):
+            rings = []
+            for ring in range(self.part_offsets[part],
+                              self.part_offsets[part + 1]):
+                start, end = self.ring_offsets[ring], self.ring_offsets[ring + 1]
+                rings.append(self.coords[start:end].tolist())
+            parts.append(rings)
+
+        if not parts:
+            # Empty geometry, e.g. POLYGON EMPTY
+            coordinates = []
+        elif geometry_type == POINT:
+            coordinates = parts[0][0][0] if parts[0][0] else []
+        elif geometry_type == LINESTRING:
+            coordinates = parts[0][0]
+        elif geometry_type == POLYGON:
+            coordinates = parts[0]
+        elif geometry_type == MULTIPOINT:
+            coordinates = [part[0][0] for part in parts]
+        elif geometry_type == MULTILINESTRING:
+            coordinates = [part[0] for part in parts]
+        else:
+            coordinates = parts
+        return {'type': GEOMETRY_NAMES[geometry_type],
+                'coordinates': coordinates}
+
+    @classmethod
+    def concatenate(cls, arrays):
+        """
+        Join several arrays into one, shifting their offsets.
+        """
+        geometry_offsets = [np.zeros(1, dtype=np.int64)]
+        part_offsets = [np.zeros(1, dtype=np.int64)]
+        ring_offsets = [np.zeros(1, dtype=np.int64)]
+        parts = rings = coords = 0
+        for array in arrays:
+            geometry_offsets.append(array.geometry_offsets[1:] + parts)
+            part_offsets.append(array.part_offsets[1:] + rings)
+            ring_offsets.append(array.ring_offsets[1:] + coords)
+            parts += len(array.part_offsets) - 1
+            rings += len(array.ring_offsets) - 1
+            coords += len(array.coords)
+        return cls(
+            np.concatenate([np.zeros(0, dtype=np.uint8)] +
+                           [array.types for array in arrays]),
+            np.concatenate([np.zeros((0, 2))] +
+                           [array.coords for array in arrays]),
+            np.concatenate(geometry_offsets),
+            np.concatenate(part_offsets),
+            np.concatenate(ring_offsets))
+
+
+def _read_uint32(data, pos, little):
+    """
+    Read an unsigned int at every position of `pos` with its byte order.
+    """
+    b = data[pos[:, None] + np.arange(4)].astype(np.int64)
+    return np.where(little,
+                    b[:, 0] | b[:, 1] << 8 | b[:, 2] << 16 | b[:, 3] << 24,
+                    b[:, 3] | b[:, 2] << 8 | b[:, 1] << 16 | b[:, 0] << 24)
+
+
+class _RingRecords(object):
+    """
+    Location of the coordinates of every ring of a page. Rings are sorted by
+    geometry and position in `build`, so they can be found in any order.
+    WKB rings point into the page buffer (`byte_starts`); GeoJSON rings have
+    a negative `byte_starts` and their coordinates in `json_rings`.
+    """
+
+    fields = ('geoms', 'seqs', 'parts', 'counts', 'byte_starts', 'strides',
+              'little')
+
+    def __init__(self):
+        for field in self.fields:
+            setattr(self, field, [])
+        self.json_rings = []
+        self._row = dict((field, []) for field in self.fields)
+
+    def add_arrays(self, geoms, seqs, parts, counts, byte_starts, strides,
+                   little):
+        for field, value in zip(self.fields, (geoms, seqs, parts, counts,
+                                              byte_starts, strides, little)):
+            getattr(self, field).append(np.asarray(value, dtype=np.int64))
+
+    def add(self, geom, seq, part, count, byte_start, stride=16, little=1):
+        for field, value in zip(self.fields, (geom, seq, part, count,
+                                              byte_start, stride, little)):
+            self._row[field].append(value)
+
+    def add_json(self, geom, seq, part, coordinates):
+        self.json_rings.append(coordinates)
+        self.add(geom, seq, part, len(coordinates), -len(self.json_rings))
+
+    def concatenate(self):
+        self.add_arrays(*(self._row[field] for field in self.fields))
+        return [np.concatenate(getattr(self, field))
+                for field in self.fields]
+
+
+class _PageDecoder(object):
+    """
+    Decodes a page of values. Headers of points, lines and polygons are read
+    with NumPy for all the page at once; multi geometries, collections and
+    GeoJSON values are walked one by one. Coordinates are always gathered at
+    once from the whole page buffer.
+    """
+
+    def __init__(self, values):
+        self.size = len(values)
+        self.types = np.zeros(self.size, dtype=np.uint8)
+        self.rings = _RingRecords()
+
+        # Hex strings are joined and decoded with a single call
+        wkb_index = [i for i, value in enumerate(values)
+                     if isinstance(value, string_types) and value and
+                     value[0] != '{']
+        hex_values = [values[i] for i in wkb_index]
+        self.buf = binascii.unhexlify(''.join(hex_values))
+        self.data = np.frombuffer(self.buf, dtype=np.uint8)
+        lengths = np.fromiter((len(value) // 2 for value in hex_values),
+                              dtype=np.int64, count=len(hex_values))
+        self.read_wkb_page(np.asarray(wkb_index, dtype=np.int64),
+                           np.cumsum(lengths) - lengths)
+
+        wkb_index = set(wkb_index)
+        for i, value in enumerate(values):
+            if i in wkb_index or not value:
+                continue
+            if isinstance(value, string_types):
+                value = json.loads(value)
+            self.types[i] = GEOMETRY_TYPES[value['type']]
+            self.read_json(i, value)
+
+    def read_headers(self, starts):
+        little = self.data[starts] == 1
+        code = _read_uint32(self.data, starts + 1, little)
+        dims = 2 + ((code & EWKB_Z) > 0) + ((code & EWKB_M) > 0)
+        ends = starts + 5 + 4 * ((code & EWKB_SRID) > 0)
+        code &= 0x0fffffff
+        # ISO WKB: 1000 = Z, 2000 = M, 3000 = ZM
+        dims += np.array([0, 1, 1, 2])[code // 1000]
+        return code % 1000, dims * 8, ends, little
+
+    def read_wkb_page(self, geoms, starts):
+        if not len(geoms):
+            return
+        code, strides, ends, little = self.read_headers(starts)
+        self.types[geoms] = code
+        rings = self.rings
+
+        simple = (code == POINT) | (code == LINESTRING)
+        counts = np.where(code == POINT, 1,
+                          _read_uint32(self.data, ends * simple, little))
+        rings.add_arrays(geoms[simple], np.zeros(simple.sum()),
+                         np.zeros(simple.sum()), counts[simple],
+                         (ends + 4 * (code == LINESTRING))[simple],
+                         strides[simple], little[simple])
+
+        # Polygons: read the n-th ring of all of them at each step
+        polygon = code == POLYGON
+        geoms_p, strides_p, little_p = (geoms[polygon], strides[polygon],
+                                        little[polygon])
+        num_rings = _read_uint32(self.data, ends[polygon], little_p)
+        pos = ends[polygon] + 4
+        for seq in range(num_rings.max() if len(num_rings) else 0):
+            active = num_rings > seq
+            counts = _read_uint32(self.data, pos[active], little_p[active])
+            rings.add_arrays(geoms_p[active], np.full(active.sum(), seq),
+                             np.zeros(active.sum()), counts,
+                             pos[active] + 4, strides_p[active],
+                             little_p[active])
+            pos[active] += 4 + counts * strides_p[active]
+
+        for geom, start in zip(geoms[~(simple | polygon)],
+                               starts[~(simple | polygon)]):
+            self.read_wkb(int(geom), int(start), [0, 0])
+
+    def read_wkb(self, geom, pos, counters):
+        """
+        Read one WKB geometry at `pos`, recording its rings. `counters` holds
+        the next ring and part numbers of the geometry. Returns the position
+        after it.
+        """
+        code, stride, pos, little = (
+            int(v[0]) for v in self.read_headers(np.array([pos])))
+        fmt = '<I' if little else '>I'
+        if code in (POINT, LINESTRING, POLYGON):
+            if code == POLYGON:
+                (num_rings,) = struct.unpack_from(fmt, self.buf, pos)
+                pos += 4
+            else:
+                num_rings = 1
+            for _ in range(num_rings):
+                if code == POINT:
+                    count = 1
+                else:
+                    (count,) = struct.unpack_from(fmt, self.buf, pos)
+                    pos += 4
+                self.rings.add(geom, counters[0], counters[1], count, pos,
+                               stride, little)
+                counters[0] += 1
+                pos += count * stride
+            counters[1] += 1
+            return pos
+        if code in (MULTIPOINT, MULTILINESTRING, MULTIPOLYGON,
+                    GEOMETRYCOLLECTION):
+            (num,) = struct.unpack_from(fmt, self.buf, pos)
+            pos += 4
+            for _ in range(num):
+                pos = self.read_wkb(geom, pos, counters)
+            return pos
+        raise ValueError('Unsupported WKB geometry type {}.'.format(code))
+
+    def read_json(self, geom, geometry, counters=None):
+        counters = counters or [0, 0]
+        code = GEOMETRY_TYPES[geometry['type']]
+        if code == GEOMETRYCOLLECTION:
+            for sub in geometry['geometries']:
+                self.read_json(geom, sub, counters)
+            return
+        coordinates = geometry['coordinates']
+        if code == POINT:
+            polygons = [[[coordinates] if coordinates else []]]
+        elif code == LINESTRING:
+            polygons = [[coordinates]]
+        elif code == POLYGON:
+            polygons = [coordinates]
+        elif code == MULTIPOINT:
+            polygons = [[[point]] for point in coordinates]
+        elif code == MULTILINESTRING:
+            polygons = [[line] for line in coordinates]
+        else:
+            polygons = coordinates
+        for rings in polygons:
+            for ring in rings:
+                self.rings.add_json(geom, counters[0], counters[1], ring)
+                counters[0] += 1
+            counters[1] += 1
+
+    def build(self):
+        geoms, seqs, parts, counts, byte_starts, strides, little = (
+            self.rings.concatenate())
+        order = np.lexsort((seqs, geoms))
+        geoms, parts, counts, byte_starts, strides, little = (
+            geoms[order], parts[order], counts[order], byte_starts[order],
+            strides[order], little[order])
+
+        ring_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=ring_offsets[1:])
+        # A new part starts when the geometry or the part number changes
+        new_part = np.ones(len(geoms), dtype=bool)
+        new_part[1:] = (geoms[1:] != geoms[:-1]) | (parts[1:] != parts[:-1])
+        part_offsets = np.append(np.flatnonzero(new_part), len(geoms))
+        geometry_offsets = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(geoms[new_part], minlength=self.size),
+                  out=geometry_offsets[1:])
+
+        coords = np.empty((ring_offsets[-1], 2), dtype=np.float64)
+        wkb = byte_starts >= 0
+        self.gather(coords, ring_offsets[:-1][wkb], counts[wkb],
+                    byte_starts[wkb], strides[wkb], little[wkb])
+        for start, count, json_id in zip(ring_offsets[:-1][~wkb],
+                                         counts[~wkb], byte_starts[~wkb]):
+            if count:
+                coords[start:start + count] = [
+                    c[:2] for c in self.rings.json_rings[-json_id - 1]]
+
+        return GeometryArray(self.types, coords, geometry_offsets,
+                             part_offsets.astype(np.int64), ring_offsets)
+
+    def gather(self, coords, coord_starts, counts, byte_starts, strides,
+               little):
+        """
+        Copy the WKB coordinates of all the rings into `coords`. The buffer is
+        viewed as doubles for each alignment and byte order, so each group of
+        coordinates is read with a single fancy index. Strides are multiples
+        of 8, so all the coordinates of a ring are in the same group.
+        """
+        groups = byte_starts % 8 + 8 * (little == 0)
+        for group in np.unique(groups):
+            align, dtype = group % 8, '<f8' if group < 8 else '>f8'
+            view = np.frombuffer(self.buf, dtype=dtype, offset=align,
+                                 count=(len(self.buf) - align) // 8)
+            selected = groups == group
+            group_counts = counts[selected]
+            within = (np.arange(group_counts.sum(), dtype=np.int64) -
+                      np.repeat(np.cumsum(group_counts) - group_counts,
+                                group_counts))
+            coord_index = (np.repeat(coord_starts[selected], group_counts) +
+                           within)
+            index = (np.repeat((byte_starts[selected] - align) // 8,
+                               group_counts) +
+                     within * np.repeat(strides[selected] // 8, group_counts))
+            coords[coord_index, 0] = view[index]
+            coords[coord_index, 1] = view[index + 1]
+
+
+def _decode_chunk(values):
+    return _PageDecoder(values).build()
+
+
+def decode_geometries(values, processes=None, chunk_size=DECODE_CHUNK_SIZE):
+    """
+    Decode a page of geometry values into a `GeometryArray`.
+    Values can be hex (E)WKB strings, GeoJSON strings or dicts, or None.
+    :param list values: Geometry values, e.g. a column of an SQL response
+    :param int processes: Decode in a pool of this many processes. Only worth
+        it for very large pages
+    :param int chunk_size: Number of values decoded by each process
+    """
+
+    if np is None:
+        raise ImportError('NumPy is required to decode geometries. '
+                          'Install it with `pip install amigocloud[numpy]`.')
+
+    values = list(values)
+    if not processes or len(values) <= chunk_size:
+        return _decode_chunk(values)
+
+    chunks = [values[i:i + chunk_size]
+              for i in range(0, len(values), chunk_size)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        arrays = pool.map(_decode_chunk, chunks)
+    finally:
+        pool.close()
+        pool.join()
+    return GeometryArray.concatenate(arrays)
+
+
+def decode_rows(rows, geometry_field, processes=None,
+                chunk_size=DECODE_CHUNK_SIZE):
+    """
+    Decode the `geometry_field` column of a list of rows (dicts).
+    """
+
+    return decode_geometries((row.get(geometry_field) for row in rows),
+                             processes=processes, chunk_size=chunk_size)
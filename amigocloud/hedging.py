@@ -0,0 +1,119 @@
+import math
+import threading
+import time
+from collections import deque
+
+from six.moves import queue
+
+
+class HedgingPolicy(object):
+    """
+    Hedged requests for idempotent GETs.
+    If a response has not arrived after the `percentile` of the recently
+    observed latencies, the same request is sent again and the first response
+    is used. The slower request is not cancelled, its response is discarded.
+    Hedges are limited to a `budget` fraction of the requests, so the extra
+    load on the server stays bounded.
+    Once `min_samples` latencies are observed, every request runs in a new
+    thread (two when hedged), even if no hedge is sent. That costs tens of
+    microseconds per request, small next to a round trip.
+    """
+
+    def __init__(self, percentile=95, budget=0.05, window=200,
+                 min_samples=20, min_delay=0.01):
+        """
+        :param float percentile: Latency percentile used as hedging delay
+        :param float budget: Maximum ratio of hedges to requests
+        :param int window: Number of recent latencies kept
+        :param int min_samples: Latencies needed before hedging starts
+        :param float min_delay: Lower bound of the delay, in seconds
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self):
+        """
+        Seconds to wait before hedging, or None if there are not enough
+        latencies observed yet.
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        rank = int(math.ceil(self.percentile / 100.0 * len(latencies))) - 1
+        return max(latencies[max(rank, 0)], self.min_delay)
+
+    def _acquire_hedge(self):
+        with self._lock:
+            if self.hedges_fired < self.budget * self.requests:
+                self.hedges_fired += 1
+                return True
+            return False
+
+    def _spawn(self, request, results, hedge):
+        def run():
+            start = time.time()
+            try:
+                response = request()
+            except Exception as exc:
+                results.put((hedge, None, exc))
+                return
+            self.record(time.time() - start)
+            results.put((hedge, response, None))
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def send(self, request):
+        """
+        Call `request` (a function without arguments doing the GET) with
+        hedging and return its result.
+        """
+        with self._lock:
+            self.requests += 1
+
+        delay = self.delay()
+        if delay is None:
+            start = time.time()
+            response = request()
+            self.record(time.time() - start)
+            return response
+
+        results = queue.Queue()
+        self._spawn(request, results, hedge=False)
+        attempts = 1
+        try:
+            outcome = results.get(timeout=delay)
+        except queue.Empty:
+            if self._acquire_hedge():
+                self._spawn(request, results, hedge=True)
+                attempts = 2
+            outcome = results.get()
+
+        # If the first attempt to finish failed, wait for the other one
+        if outcome[2] is not None and attempts == 2:
+            other = results.get()
+            if other[2] is None:
+                outcome = other
+
+        hedge, response, error = outcome
+        if error is not None:
+            raise error
+        if hedge:
+            with self._lock:
+                self.hedges_won += 1
+        return response
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from six.moves import http_cookiejar
+
+from .amigocloud import AmigoCloud, BASE_URL
+
+
+def shared_session(pool_maxsize=50):
+    """
+    Session whose connection pool can be shared by the clients of different
+    tokens. Cookies are never stored, so nothing set by the server for one
+    token is sent with the requests of another one.
+    """
+
+    session = requests.Session()
+    session.cookies.set_policy(
+        http_cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    adapter = requests.adapters.HTTPAdapter(pool_connections=10,
+                                            pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class _Flight(object):
+    """
+    Authentication in progress for a token, waited by the other callers.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.client = None
+        self.error = None
+        # Set when the token is invalidated during the authentication
+        self.stale = False
+
+
+class AmigoCloudPool(object):
+    """
+    Hands out `AmigoCloud` clients for many tokens (e.g. one project token
+    per customer). All clients share one connection pool, the result of the
+    authentication is cached for `auth_ttl` seconds and, when there are more
+    than `max_clients`, the least recently used client is evicted.
+    Clients are created without websockets.
+    """
+
+    def __init__(self, base_url=BASE_URL, max_clients=1000, auth_ttl=300,
+                 session=None, **client_kwargs):
+        """
+        :param str base_url: points to https://app.amigocloud.com by default
+        :param int max_clients: Number of clients kept
+        :param float auth_ttl: Seconds before a client authenticates again
+        :param requests.Session session: Shared session. By default one is
+            created with `shared_session`
+        :param client_kwargs: Extra arguments for `AmigoCloud`, e.g. `timer`
+            or `hedging`
+        """
+        self.base_url = base_url
+        self.max_clients = max_clients
+        self.auth_ttl = auth_ttl
+        self.session = session or shared_session()
+        self.client_kwargs = client_kwargs
+
+        self._clients = OrderedDict()  # key: (client, authenticated at)
+        self._flights = {}  # key: _Flight of the authentication in progress
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get_client(self, token, project_url=None):
+        """
+        Return the client of a token (and project url, for project tokens).
+        Only the first call, or the first one after `auth_ttl` seconds, does
+        the authentication request. Concurrent calls for the same token wait
+        for that request instead of doing their own.
+        """
+        key = (token, project_url)
+        now = time.time()
+        with self._lock:
+            entry = self._clients.pop(key, None)
+            if entry is not None:
+                # Re-insert it as the most recently used
+                self._clients[key] = entry
+                if now - entry[1] < self.auth_ttl:
+                    return entry[0]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.client
+
+        # Authenticate out of the lock, so other tokens are not blocked
+        try:
+            client = AmigoCloud(base_url=self.base_url, use_websockets=False,
+                                session=self.session, **self.client_kwargs)
+            client.authenticate(token, project_url)
+        except Exception as exc:
+            flight.error = exc
+            raise
+        else:
+            flight.client = client
+            with self._lock:
+                if not flight.stale:
+                    self._clients.pop(key, None)
+                    self._clients[key] = (client, now)
+                    while len(self._clients) > self.max_clients:
+                        self._clients.popitem(last=False)
+            return client
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def invalidate(self, token, project_url=None):
+        """
+        Forget the client of a token, e.g. after the token was revoked.
+        A client being authenticated at the same time is not cached.
+        """
+        key = (token, project_url)
+        with self._lock:
+            self._clients.pop(key, None)
+            if key in self._flights:
+                self._flights[key].stale = True
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            for flight in self._flights.values():
+                flight.stale = True
@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class PhaseTimer(object):
+    """
+    Accumulates the time spent in named phases (e.g. network, JSON decode).
+    Phases timed from several threads are added up, so their total can be
+    greater than the wall time.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.totals = OrderedDict()
+        self.counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with self._lock:
+                self.totals[name] = self.totals.get(name, 0) + elapsed
+                self.counts[name] = self.counts.get(name, 0) + 1
+
+    def report(self):
+        """
+        Return the breakdown of the phases as a printable table.
+        """
+        wall = time.time() - self.start
+        lines = ['%-14s %10s %8s %7s' % ('phase', 'seconds', 'calls',
+                                         '% wall')]
+        for name, total in self.totals.items():
+            lines.append('%-14s %10.3f %8d %6.1f%%' % (
+                name, total, self.counts[name],
+                100.0 * total / wall if wall else 0))
+        lines.append('%-14s %10.3f' % ('wall', wall))
+        return '\n'.join(lines)
+
+
+class NullTimer(object):
+    """
+    Timer doing nothing, used when profiling is disabled.
+    """
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+
+NULL_TIMER = NullTimer()
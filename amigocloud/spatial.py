@@ -0,0 +1,207 @@
+import heapq
+import math
+
+TILE_BBOX_COLUMNS = ('_tile_xmin', '_tile_ymin', '_tile_xmax', '_tile_ymax')
+
+
+def split_extent(extent, tiles):
+    """
+    Split an `(xmin, ymin, xmax, ymax)` extent into a `tiles` x `tiles` grid.
+    Returns a list of extents, row by row.
+    """
+
+    xmin, ymin, xmax, ymax = extent
+    width = float(xmax - xmin) / tiles
+    height = float(ymax - ymin) / tiles
+    result = []
+    for row in range(tiles):
+        for col in range(tiles):
+            # Use the real bounds for the last row/column to avoid leaving
+            # gaps because of floating point rounding.
+            result.append((
+                xmin + col * width,
+                ymin + row * height,
+                xmax if col == tiles - 1 else xmin + (col + 1) * width,
+                ymax if row == tiles - 1 else ymin + (row + 1) * height,
+            ))
+    return result
+
+
+def tile_query(dataset_id, geometry_field, tile, srid=4326):
+    """
+    Build the SQL query returning the rows of a dataset whose geometry
+    bounding box intersects `tile`, including that bounding box.
+    """
+
+    bbox_columns = ', '.join(
+        '{func}({geo_column}) AS {alias}'.format(func=func,
+                                                 geo_column=geometry_field,
+                                                 alias=alias)
+        for func, alias in zip(('ST_XMin', 'ST_YMin', 'ST_XMax', 'ST_YMax'),
+                               TILE_BBOX_COLUMNS))
+    return ('SELECT *, {bbox_columns} '
+            'FROM dataset_{dataset_id} '
+            'WHERE {geo_column} && '
+            'ST_MakeEnvelope({xmin!r}, {ymin!r}, {xmax!r}, {ymax!r}, {srid})'
+            ).format(bbox_columns=bbox_columns,
+                     dataset_id=dataset_id,
+                     geo_column=geometry_field,
+                     xmin=float(tile[0]), ymin=float(tile[1]),
+                     xmax=float(tile[2]), ymax=float(tile[3]),
+                     srid=srid)
+
+
+def bbox_distance(bbox, x, y):
+    """
+    Euclidean distance from the point `(x, y)` to a bounding box. It is zero
+    if the point is inside the box.
+    """
+
+    dx = max(bbox[0] - x, 0, x - bbox[2])
+    dy = max(bbox[1] - y, 0, y - bbox[3])
+    return math.sqrt(dx * dx + dy * dy)
+
+
+class SpatialIndex(object):
+    """
+    In-memory grid index of bounding boxes.
+    The extent is divided in `cells` x `cells` buckets and every item is
+    registered in all the buckets its bounding box touches. Items outside the
+    extent are kept in the border buckets, so they are still found.
+    """
+
+    def __init__(self, extent, cells=64):
+        """
+        :param tuple extent: `(xmin, ymin, xmax, ymax)` covered by the grid
+        :param int cells: Number of buckets per axis
+        """
+        self.extent = tuple(float(v) for v in extent)
+        self.cells = cells
+        xmin, ymin, xmax, ymax = self.extent
+        # Avoid zero sized cells for degenerate extents (e.g. a single point)
+        self.cell_width = (xmax - xmin) / cells or 1.0
+        self.cell_height = (ymax - ymin) / cells or 1.0
+
+        self._items = {}
+        self._bboxes = {}
+        self._grid = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def _cell(self, x, y):
+        col = int((x - self.extent[0]) / self.cell_width)
+        row = int((y - self.extent[1]) / self.cell_height)
+        return (min(max(col, 0), self.cells - 1),
+                min(max(row, 0), self.cells - 1))
+
+    def _cell_range(self, bbox):
+        col_min, row_min = self._cell(bbox[0], bbox[1])
+        col_max, row_max = self._cell(bbox[2], bbox[3])
+        for col in range(col_min, col_max + 1):
+            for row in range(row_min, row_max + 1):
+                yield col, row
+
+    def insert(self, key, bbox, item=None):
+        """
+        Add an item to the index. Inserting an existing key replaces it.
+        :param key: Unique identifier of the item (e.g. its `amigo_id`)
+        :param tuple bbox: `(xmin, ymin, xmax, ymax)` of the item
+        :param item: Object to store. Defaults to `key`
+        """
+        if key in self._items:
+            self.remove(key)
+        bbox = tuple(float(v) for v in bbox)
+        self._items[key] = key if item is None else item
+        self._bboxes[key] = bbox
+        for cell in self._cell_range(bbox):
+            self._grid.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        """
+        Remove an item from the index. Raises KeyError if it does not exist.
+        """
+        bbox = self._bboxes.pop(key)
+        del self._items[key]
+        for cell in self._cell_range(bbox):
+            bucket = self._grid[cell]
+            bucket.discard(key)
+            if not bucket:
+                del self._grid[cell]
+
+    def bbox(self, key):
+        return self._bboxes[key]
+
+    def intersection(self, bbox):
+        """
+        Return the items whose bounding box intersects `bbox`.
+        """
+        xmin, ymin, xmax, ymax = bbox
+        seen = set()
+        result = []
+        for cell in self._cell_range(bbox):
+            for key in self._grid.get(cell, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                item_bbox = self._bboxes[key]
+                if (item_bbox[0] <= xmax and item_bbox[2] >= xmin and
+                        item_bbox[1] <= ymax and item_bbox[3] >= ymin):
+                    result.append(self._items[key])
+        return result
+
+    def nearest(self, x, y, k=1):
+        """
+        Return the `k` items whose bounding box is closest to `(x, y)`, from
+        nearest to farthest.
+        """
+        if k <= 0 or not self._items:
+            return []
+        col, row = self._cell(x, y)
+        # Cells in ring `r` are at least `(r - 1) * min_cell` away from the
+        # point, so the search can stop once that exceeds the k-th best.
+        min_cell = min(self.cell_width, self.cell_height)
+        best = []  # max-heap of (-distance, insertion order, key)
+        seen = set()
+        for radius in range(self.cells):
+            if len(best) == k and -best[0][0] < (radius - 1) * min_cell:
+                break
+            for cell in self._ring(col, row, radius):
+                for key in self._grid.get(cell, ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    distance = bbox_distance(self._bboxes[key], x, y)
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, len(seen), key))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, len(seen), key))
+        return [self._items[key] for _, _, key in
+                sorted(best, key=lambda entry: -entry[0])]
+
+    def _ring(self, col, row, radius):
+        if radius == 0:
+            yield col, row
+            return
+        last = self.cells - 1
+        col_min, col_max = max(col - radius, 0), min(col + radius, last)
+        for c in range(col_min, col_max + 1):
+            if row - radius >= 0:
+                yield c, row - radius
+            if row + radius <= last:
+                yield c, row + radius
+        for r in range(max(row - radius + 1, 0),
+                       min(row + radius - 1, last) + 1):
+            if col - radius >= 0:
+                yield col - radius, r
+            if col + radius <= last:
+                yield col + radius, r
@@ -0,0 +1,72 @@
+"""
+Compare page decoding (`decode_geometries`) against decoding each row with
+`struct`, which is what was done before.
+
+    python benchmarks/geometry_decoding.py [rows]
+
+It can be run from a checkout, the repository root is added to the path.
+"""
+import binascii
+import os
+import random
+import struct
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from amigocloud.geometry import decode_geometries  # noqa: E402
+
+
+def make_values(count):
+    rnd = random.Random(0)
+    values = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            body = struct.pack('<BIIdd', 1, 0x20000001, 4326,
+                               rnd.random(), rnd.random())
+        else:
+            coords = [rnd.random() for _ in range(2 * 20)]
+            if kind == 1:
+                body = struct.pack('<BIII', 1, 0x20000002, 4326, 20)
+            else:
+                coords[-2:] = coords[:2]
+                body = struct.pack('<BIIII', 1, 0x20000003, 4326, 1, 20)
+            body += struct.pack('<%dd' % len(coords), *coords)
+        values.append(binascii.hexlify(body).decode('ascii'))
+    return values
+
+
+def decode_row(value):
+    """Per row baseline, only for the geometries built above."""
+    data = binascii.unhexlify(value)
+    (code,) = struct.unpack_from('<I', data, 1)
+    code &= 0xff
+    if code == 1:
+        return [list(struct.unpack_from('<dd', data, 9))]
+    pos = 13 if code == 2 else 17
+    (count,) = struct.unpack_from('<I', data, pos - 4)
+    flat = struct.unpack_from('<%dd' % (2 * count), data, pos)
+    return [list(flat[i:i + 2]) for i in range(0, len(flat), 2)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    values = make_values(count)
+
+    timings = [
+        ('per row', lambda: [decode_row(v) for v in values]),
+        ('page', lambda: decode_geometries(values)),
+        ('page, 4 processes', lambda: decode_geometries(
+            values, processes=4, chunk_size=count // 4 + 1)),
+    ]
+    print('%d geometries' % count)
+    for name, func in timings:
+        best = min(timeit.repeat(func, number=1, repeat=3))
+        print('%-20s %8.3f s' % (name, best))
+
+
+if __name__ == '__main__':
+    main()
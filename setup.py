@@ -29,6 +29,8 @@ setup(
     url='https://github.com/amigocloud/python-amigocloud',
     download_url=download_url % version,
     install_requires=requires,
+    extras_require={'numpy': ['numpy']},
+    entry_points={'console_scripts': ['amigocloud = amigocloud.cli:main']},
     license='MIT',
     keywords=(
         'gis geo geographic spatial spatial-data spatial-data-analysis '
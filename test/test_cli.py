@@ -0,0 +1,173 @@
+import json
+import time
+
+import pytest
+import requests
+from six.moves.urllib.parse import parse_qsl, urlencode, urlparse
+
+from amigocloud.cli import build_parser, main
+from amigocloud.profiling import PhaseTimer
+
+
+class TestCli:
+    """
+    `pytest test/test_cli.py`
+    """
+
+    def test_parse_export(self):
+        args = build_parser().parse_args([
+            '--token', 'T', '--workers', '4', '--page-size', '500',
+            '--profile', 'export', 'projects/1/sql', 'rows.csv',
+            '--query', 'select 1', '--format', 'csv'])
+        assert args.workers == 4
+        assert args.page_size == 500
+        assert args.profile
+        assert args.query == 'select 1'
+        assert args.format == 'csv'
+
+    def test_parse_geocode_components(self):
+        args = build_parser().parse_args([
+            'geocode', '1', '2', 'address', 'geom',
+            '--component', 'country=PE', '--component', 'locality=Lima'])
+        assert args.component == ['country=PE', 'locality=Lima']
+
+    def test_token_required(self, monkeypatch):
+        monkeypatch.delenv('AMIGOCLOUDTOKEN', raising=False)
+        with pytest.raises(SystemExit):
+            main(['sql', '1', 'select 1'])
+
+    def test_phase_timer(self):
+        timer = PhaseTimer()
+        for _ in range(3):
+            with timer.phase('network'):
+                pass
+        assert timer.counts['network'] == 3
+        assert 'network' in timer.report()
+
+
+class FakeResponse(object):
+    status_code = 200
+
+    def __init__(self, data):
+        self.text = json.dumps(data)
+        self.content = self.text.encode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeApi(object):
+    """
+    Answers `requests.get` and `requests.post` like the AmigoCloud API, with
+    a sql endpoint returning `rows` rows paginated by offset.
+    """
+
+    def __init__(self, rows=25):
+        self.rows = rows
+        self.gets = []
+        self.posts = []
+
+    def get(self, url, params=None, **kwargs):
+        # Parse what reaches the server: repeated parameters (e.g. in a
+        # `next` link and in `params`) take the last value, as in the server
+        parsed = urlparse(
+            requests.Request('GET', url, params=params).prepare().url)
+        query = dict(parse_qsl(parsed.query))
+        self.gets.append((parsed.path, query))
+        assert len(self.gets) < 100, 'pagination does not end'
+        if parsed.path.endswith('/me'):
+            return FakeResponse({'id': 1})
+        if parsed.path.endswith('/geocoder/search'):
+            return FakeResponse({'features': [
+                {'geometry': {'coordinates': [1.0, 2.0]}}]})
+        if parsed.path.endswith('/datasets/9'):
+            return FakeResponse({'feature_count': self.rows})
+        if 'count(*)' in query.get('query', ''):
+            return FakeResponse({'data': [{'count': self.rows}]})
+
+        offset, limit = int(query.get('offset', 0)), int(query['limit'])
+        # Earlier pages are slower, so parallel pages finish out of order
+        time.sleep(0.01 * max(0, 5 - offset // limit))
+        next_url = None
+        if offset + limit < self.rows:
+            next_url = 'http://fake%s?%s' % (parsed.path, urlencode(
+                {'offset': offset + limit, 'limit': limit}))
+        data = [{'amigo_id': str(i), 'address': 'street %d' % i}
+                for i in range(offset, min(offset + limit, self.rows))]
+        return FakeResponse({'count': self.rows, 'next': next_url,
+                             'data': data})
+
+    def post(self, url, data=None, **kwargs):
+        self.posts.append((urlparse(url).path, data))
+        return FakeResponse({'id': len(self.posts)})
+
+
+@pytest.fixture
+def api(monkeypatch):
+    fake = FakeApi()
+    monkeypatch.setattr(requests, 'get', fake.get)
+    monkeypatch.setattr(requests, 'post', fake.post)
+    return fake
+
+
+def run(*argv):
+    return main(['--token', 'T', '--base-url', 'http://fake'] + list(argv))
+
+
+class TestCliCommands:
+
+    def test_export_jsonl_follows_next(self, api, tmp_path):
+        output = str(tmp_path / 'rows.jsonl')
+        assert run('--page-size', '10', 'export', 'projects/1/sql', output,
+                   '--query', 'select 1') == 0
+        with open(output) as f:
+            rows = [json.loads(line) for line in f]
+        assert [row['amigo_id'] for row in rows] == [str(i) for i in range(25)]
+        offsets = [q.get('offset') for path, q in api.gets
+                   if path.endswith('/sql')]
+        assert offsets == [None, '10', '20']
+
+    def test_export_csv_parallel_keeps_order(self, api, tmp_path):
+        output = str(tmp_path / 'rows.csv')
+        assert run('--page-size', '5', '--workers', '4', 'export',
+                   'projects/1/sql', output, '--query', 'select 1',
+                   '--format', 'csv') == 0
+        with open(output) as f:
+            lines = f.read().splitlines()
+        assert lines[0] == 'amigo_id,address'
+        assert lines[1:] == ['%d,street %d' % (i, i) for i in range(25)]
+        offsets = sorted(int(q['offset']) for path, q in api.gets
+                         if path.endswith('/sql'))
+        assert offsets == [0, 5, 10, 15, 20]
+
+    def test_sql(self, api, capsys):
+        assert run('sql', '1', 'select 1') == 0
+        assert json.loads(capsys.readouterr().out)['count'] == 25
+        assert run('sql', '1', 'update x', '--write') == 0
+        assert api.posts[-1] == ('/api/v1/projects/1/sql',
+                                 json.dumps({'query': 'update x'}))
+
+    def test_upload(self, api, tmp_path, capsys):
+        paths = []
+        for name in ('a.csv', 'b.csv'):
+            path = tmp_path / name
+            path.write_text(u'id\n1\n')
+            paths.append(str(path))
+        assert run('--workers', '2', 'upload', '123', '1', *paths) == 0
+        results = [json.loads(line)
+                   for line in capsys.readouterr().out.splitlines()]
+        assert sorted(result['file'] for result in results) == paths
+        assert all(path == '/api/v1/users/123/projects/1/datasets/upload'
+                   for path, _ in api.posts)
+
+    def test_geocode_keeps_default_batch_size(self, api):
+        assert run('geocode', '1', '9', 'address', 'geom') == 0
+        updates = [data for path, data in api.posts if 'UPDATE' in data]
+        # 25 addresses in batches of 30: a single UPDATE
+        assert len(updates) == 1
+
+    def test_geocode_batch_size(self, api):
+        assert run('--workers', '3', 'geocode', '1', '9', 'address', 'geom',
+                   '--batch-size', '10') == 0
+        updates = [data for path, data in api.posts if 'UPDATE' in data]
+        assert len(updates) == 3
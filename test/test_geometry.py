@@ -0,0 +1,111 @@
+import binascii
+import json
+import struct
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from amigocloud.geometry import GeometryArray, decode_geometries, decode_rows
+
+
+def wkb(geometry, little=True, srid=None, z=False):
+    """Encode a GeoJSON like dict as hex (E)WKB."""
+    fmt = '<' if little else '>'
+    codes = {'Point': 1, 'LineString': 2, 'Polygon': 3, 'MultiPoint': 4,
+             'MultiLineString': 5, 'MultiPolygon': 6}
+    code = codes[geometry['type']]
+    if srid:
+        code |= 0x20000000
+    if z:
+        code |= 0x80000000
+    out = struct.pack(fmt + 'BI', 1 if little else 0, code)
+    if srid:
+        out += struct.pack(fmt + 'I', srid)
+
+    def point(c):
+        return struct.pack(fmt + ('ddd' if z else 'dd'),
+                           *(list(c) + [7.0] if z else c))
+
+    def ring(cs):
+        return struct.pack(fmt + 'I', len(cs)) + b''.join(point(c) for c in cs)
+
+    coordinates = geometry['coordinates']
+    if code & 0xff == 1:
+        out += point(coordinates)
+    elif code & 0xff == 2:
+        out += ring(coordinates)
+    elif code & 0xff == 3:
+        out += struct.pack(fmt + 'I', len(coordinates))
+        out += b''.join(ring(r) for r in coordinates)
+    else:
+        sub_type = {4: 'Point', 5: 'LineString', 6: 'Polygon'}[code & 0xff]
+        out += struct.pack(fmt + 'I', len(coordinates))
+        out += b''.join(binascii.unhexlify(wkb(
+            {'type': sub_type, 'coordinates': c}, little, z=z))
+            for c in coordinates)
+    return binascii.hexlify(out).decode('ascii')
+
+
+GEOMETRIES = [
+    {'type': 'Point', 'coordinates': [1.5, -2.0]},
+    {'type': 'LineString', 'coordinates': [[0.0, 0.0], [1.0, 1.0], [2.0, 0.5]]},
+    {'type': 'Polygon', 'coordinates': [
+        [[0.0, 0.0], [4.0, 0.0], [4.0, 4.0], [0.0, 0.0]],
+        [[1.0, 1.0], [2.0, 1.0], [2.0, 2.0], [1.0, 1.0]]]},
+    {'type': 'MultiPoint', 'coordinates': [[1.0, 2.0], [3.0, 4.0]]},
+    {'type': 'MultiLineString', 'coordinates': [
+        [[0.0, 0.0], [1.0, 1.0]], [[5.0, 5.0], [6.0, 6.0], [7.0, 5.0]]]},
+    {'type': 'MultiPolygon', 'coordinates': [
+        [[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 0.0]]],
+        [[[9.0, 9.0], [8.0, 9.0], [8.0, 8.0], [9.0, 9.0]]]]},
+]
+
+
+class TestDecodeGeometries:
+    """
+    `pytest test/test_geometry.py`
+    """
+
+    def test_wkb_round_trip(self):
+        values = [wkb(g) for g in GEOMETRIES]
+        array = decode_geometries(values)
+        assert len(array) == len(GEOMETRIES)
+        for i, geometry in enumerate(GEOMETRIES):
+            assert array[i] == geometry
+
+    def test_ewkb_big_endian_and_z(self):
+        values = [wkb(g, little=False, srid=4326, z=True) for g in GEOMETRIES]
+        array = decode_geometries(values)
+        assert [array[i] for i in range(len(array))] == GEOMETRIES
+
+    def test_geojson_and_nulls(self):
+        values = [json.dumps(GEOMETRIES[2]), None, GEOMETRIES[5], '',
+                  wkb(GEOMETRIES[0])]
+        array = decode_geometries(values)
+        assert list(array.types) == [3, 0, 6, 0, 1]
+        assert array[0] == GEOMETRIES[2]
+        assert array[1] is None
+        assert array[2] == GEOMETRIES[5]
+        assert array[4] == GEOMETRIES[0]
+
+    def test_offsets(self):
+        array = decode_geometries([wkb(g) for g in GEOMETRIES])
+        assert list(array.geometry_offsets) == [0, 1, 2, 3, 5, 7, 9]
+        assert list(array.part_offsets) == [0, 1, 2, 4, 5, 6, 7, 8, 9, 10]
+        assert array.coords.shape == (array.ring_offsets[-1], 2)
+
+    def test_decode_rows_with_processes(self):
+        rows = [{'amigo_id': str(i), 'geom': wkb(g)}
+                for i in range(20) for g in GEOMETRIES]
+        serial = decode_rows(rows, 'geom')
+        parallel = decode_rows(rows, 'geom', processes=2, chunk_size=25)
+        for name in ('types', 'coords', 'geometry_offsets', 'part_offsets',
+                     'ring_offsets'):
+            assert np.array_equal(getattr(serial, name),
+                                  getattr(parallel, name))
+
+    def test_concatenate_empty(self):
+        array = GeometryArray.concatenate([decode_geometries([])])
+        assert len(array) == 0
+        assert list(array.geometry_offsets) == [0]
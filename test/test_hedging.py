@@ -0,0 +1,144 @@
+import itertools
+import json
+import time
+
+import pytest
+
+from amigocloud import AmigoCloud
+from amigocloud.hedging import HedgingPolicy
+
+
+def warm_up(policy, latency=0.01, samples=20):
+    for _ in range(samples):
+        policy.record(latency)
+    policy.requests = 100
+
+
+def slow_first(delays):
+    """Request function sleeping `delays[n]` on its n-th call."""
+    calls = itertools.count()
+
+    def request():
+        n = next(calls)
+        time.sleep(delays[n])
+        return n
+    return request
+
+
+class TestHedgingPolicy:
+    """
+    `pytest test/test_hedging.py`
+    """
+
+    def test_no_hedge_without_samples(self):
+        policy = HedgingPolicy(min_samples=5)
+        assert policy.delay() is None
+        assert policy.send(lambda: 'ok') == 'ok'
+        assert policy.hedges_fired == 0
+        assert len(policy._latencies) == 1
+
+    def test_delay_percentile(self):
+        policy = HedgingPolicy(percentile=90, min_samples=10, min_delay=0)
+        for i in range(1, 11):
+            policy.record(i / 100.0)
+        assert policy.delay() == pytest.approx(0.09)
+
+    def test_hedge_wins(self):
+        policy = HedgingPolicy(min_samples=20)
+        warm_up(policy)
+        assert policy.send(slow_first([0.5, 0])) == 1
+        assert policy.hedges_fired == 1
+        assert policy.hedges_won == 1
+
+    def test_primary_wins(self):
+        policy = HedgingPolicy(min_samples=20)
+        warm_up(policy)
+        assert policy.send(slow_first([0.05, 0.5])) == 0
+        assert policy.hedges_fired == 1
+        assert policy.hedges_won == 0
+
+    def test_budget(self):
+        policy = HedgingPolicy(min_samples=20, budget=0)
+        warm_up(policy)
+        assert policy.send(slow_first([0.05, 0])) == 0
+        assert policy.hedges_fired == 0
+
+    def test_error_falls_back_to_other_attempt(self):
+        calls = itertools.count()
+
+        def request():
+            if next(calls) == 0:
+                time.sleep(0.1)
+                raise IOError('connection reset')
+            time.sleep(0.2)
+            return 'ok'
+
+        policy = HedgingPolicy(min_samples=20)
+        warm_up(policy)
+        assert policy.send(request) == 'ok'
+        assert policy.hedges_won == 1
+
+    def test_error_raised(self):
+        def request():
+            raise IOError('connection reset')
+
+        policy = HedgingPolicy(min_samples=20)
+        warm_up(policy)
+        with pytest.raises(IOError):
+            policy.send(request)
+
+
+class FakeResponse(object):
+
+    def __init__(self, data):
+        self.text = json.dumps(data)
+        self.content = self.text.encode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+
+class SlowFirstSession(object):
+    """Session whose first GET is slow and the following ones are fast."""
+
+    def __init__(self):
+        self.calls = []
+        self._calls = itertools.count()
+
+    def get(self, url, params=None, **kwargs):
+        n = next(self._calls)
+        self.calls.append(kwargs.get('stream', False))
+        if n == 0:
+            time.sleep(0.5)
+        return FakeResponse({'call': n, 'next': None, 'data': [{'call': n}]})
+
+
+class TestHedgedClient:
+
+    def client(self):
+        policy = HedgingPolicy(min_samples=20)
+        warm_up(policy)
+        session = SlowFirstSession()
+        client = AmigoCloud(use_websockets=False, session=session,
+                            hedging=policy)
+        return client, session, policy
+
+    def test_get_is_hedged(self):
+        client, session, policy = self.client()
+        assert client.get('/me')['call'] == 1
+        assert policy.hedges_fired == 1
+        assert policy.hedges_won == 1
+
+    def test_cursor_is_hedged(self):
+        client, session, policy = self.client()
+        assert list(client.get_cursor('/me/projects')) == [{'call': 1}]
+        assert policy.hedges_fired == 1
+        assert policy.hedges_won == 1
+
+    def test_stream_is_not_hedged(self):
+        client, session, policy = self.client()
+        response = client.get('/me', stream=True)
+        assert json.loads(response.text)['call'] == 0
+        assert session.calls == [True]
+        assert policy.requests == 100
+        assert policy.hedges_fired == 0
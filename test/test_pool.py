@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+
+import requests
+
+from amigocloud import AmigoCloudError
+from amigocloud.pool import AmigoCloudPool
+
+
+class FakeResponse(object):
+
+    def __init__(self, data):
+        self.text = json.dumps(data)
+        self.content = self.text.encode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession(object):
+    """Answers every GET with the id of the project (or user) requested."""
+
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, params=None, **kwargs):
+        self.urls.append(url)
+        return FakeResponse({'id': url.rstrip('/').rsplit('/', 1)[-1]})
+
+
+class SlowSession(FakeSession):
+    """Slow authentication, so concurrent calls overlap."""
+
+    def __init__(self, fail=False):
+        super(SlowSession, self).__init__()
+        self.fail = fail
+
+    def get(self, url, params=None, **kwargs):
+        time.sleep(0.1)
+        if self.fail:
+            self.urls.append(url)
+            response = requests.Response()
+            response.status_code = 403
+            response.url = url
+            return response
+        return super(SlowSession, self).get(url, params=params, **kwargs)
+
+
+class TestAmigoCloudPool:
+    """
+    `pytest test/test_pool.py`
+    """
+
+    def test_authentication_is_cached(self):
+        session = FakeSession()
+        pool = AmigoCloudPool(session=session)
+        client = pool.get_client('C:token', 'users/1/projects/10')
+        assert client._project_id == '10'
+        assert pool.get_client('C:token', 'users/1/projects/10') is client
+        assert len(session.urls) == 1
+
+    def test_clients_share_the_session(self):
+        session = FakeSession()
+        pool = AmigoCloudPool(session=session)
+        first = pool.get_client('C:a', 'users/1/projects/10')
+        second = pool.get_client('C:b', 'users/1/projects/20')
+        assert first is not second
+        assert first.session is second.session is session
+        second.get('datasets')
+        assert session.urls[-1].endswith('/users/1/projects/20/datasets')
+
+    def test_auth_ttl(self):
+        session = FakeSession()
+        pool = AmigoCloudPool(session=session, auth_ttl=0)
+        pool.get_client('C:token', 'users/1/projects/10')
+        pool.get_client('C:token', 'users/1/projects/10')
+        assert len(session.urls) == 2
+
+    def test_lru_eviction(self):
+        session = FakeSession()
+        pool = AmigoCloudPool(session=session, max_clients=2)
+        a = pool.get_client('C:a', 'users/1/projects/1')
+        pool.get_client('C:b', 'users/1/projects/2')
+        assert pool.get_client('C:a', 'users/1/projects/1') is a
+        pool.get_client('C:c', 'users/1/projects/3')
+        assert len(pool) == 2
+        # `b` was the least recently used
+        pool.get_client('C:b', 'users/1/projects/2')
+        assert len(session.urls) == 4
+        assert pool.get_client('C:c', 'users/1/projects/3')
+        assert len(session.urls) == 4
+
+    def test_invalidate(self):
+        session = FakeSession()
+        pool = AmigoCloudPool(session=session)
+        pool.get_client('C:token', 'users/1/projects/10')
+        pool.invalidate('C:token', 'users/1/projects/10')
+        assert len(pool) == 0
+
+    def test_concurrent_misses_authenticate_once(self):
+        session = SlowSession()
+        pool = AmigoCloudPool(session=session)
+        clients = []
+
+        def get_client():
+            clients.append(pool.get_client('C:token', 'users/1/projects/10'))
+
+        threads = [threading.Thread(target=get_client) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(session.urls) == 1
+        assert len(clients) == 8
+        assert all(client is clients[0] for client in clients)
+
+    def test_concurrent_misses_share_the_error(self):
+        session = SlowSession(fail=True)
+        pool = AmigoCloudPool(session=session)
+        errors = []
+
+        def get_client():
+            try:
+                pool.get_client('C:token', 'users/1/projects/10')
+            except AmigoCloudError as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=get_client) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(session.urls) == 1
+        assert len(errors) == 4
+        assert len(pool) == 0
+        # The failure is not cached
+        session.fail = False
+        assert pool.get_client('C:token', 'users/1/projects/10')
+
+    def test_invalidate_during_authentication(self):
+        session = SlowSession()
+        pool = AmigoCloudPool(session=session)
+        thread = threading.Thread(
+            target=pool.get_client, args=('C:token', 'users/1/projects/10'))
+        thread.start()
+        time.sleep(0.05)
+        pool.invalidate('C:token', 'users/1/projects/10')
+        thread.join()
+        assert len(pool) == 0
+        pool.get_client('C:token', 'users/1/projects/10')
+        assert len(session.urls) == 2
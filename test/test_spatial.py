@@ -0,0 +1,164 @@
+import json
+import math
+import random
+import re
+
+import requests
+from six.moves.urllib.parse import parse_qsl, urlencode, urlparse
+
+from amigocloud import AmigoCloud
+from amigocloud.spatial import (SpatialIndex, bbox_distance, split_extent,
+                                tile_query)
+
+
+class TestSpatialIndex:
+    """
+    `pytest test/test_spatial.py`
+    """
+
+    def build_index(self, count=500, cells=16):
+        rnd = random.Random(1234)
+        index = SpatialIndex((0, 0, 100, 100), cells=cells)
+        bboxes = {}
+        for i in range(count):
+            # Some items fall outside of the extent on purpose
+            x, y = rnd.uniform(-10, 110), rnd.uniform(-10, 110)
+            bbox = (x, y, x + rnd.uniform(0, 5), y + rnd.uniform(0, 5))
+            bboxes[str(i)] = bbox
+            index.insert(str(i), bbox, {'amigo_id': str(i)})
+        return index, bboxes
+
+    def test_split_extent(self):
+        tiles = split_extent((0, 0, 10, 20), 2)
+        assert tiles == [(0, 0, 5, 10), (5, 0, 10, 10),
+                         (0, 10, 5, 20), (5, 10, 10, 20)]
+
+    def test_tile_query(self):
+        query = tile_query('12', 'geom', (0, 1, 2, 3))
+        assert 'FROM dataset_12' in query
+        assert 'geom && ST_MakeEnvelope(0.0, 1.0, 2.0, 3.0, 4326)' in query
+
+    def test_intersection(self):
+        index, bboxes = self.build_index()
+        query = (20, 30, 45, 60)
+        expected = set(
+            key for key, b in bboxes.items()
+            if b[0] <= query[2] and b[2] >= query[0] and
+            b[1] <= query[3] and b[3] >= query[1])
+        found = set(row['amigo_id'] for row in index.intersection(query))
+        assert found == expected
+
+    def test_nearest(self):
+        index, bboxes = self.build_index()
+        for x, y in ((50, 50), (0, 0), (-30, 120), (99.5, 3)):
+            expected = sorted(bbox_distance(b, x, y) for b in bboxes.values())
+            found = [bbox_distance(bboxes[row['amigo_id']], x, y)
+                     for row in index.nearest(x, y, k=5)]
+            assert all(math.isclose(a, b) for a, b in zip(found, expected[:5]))
+
+    def test_insert_replace_and_remove(self):
+        index = SpatialIndex((0, 0, 10, 10), cells=4)
+        index.insert('a', (1, 1, 2, 2))
+        index.insert('a', (8, 8, 9, 9))
+        assert len(index) == 1
+        assert index.intersection((0, 0, 3, 3)) == []
+        assert index.nearest(8.5, 8.5) == ['a']
+        index.remove('a')
+        assert len(index) == 0
+        assert index.nearest(0, 0) == []
+
+
+class FakeResponse(object):
+
+    def __init__(self, data):
+        self.text = json.dumps(data)
+        self.content = self.text.encode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+
+class TestGetSpatialIndex:
+    """
+    `get_spatial_index` with `requests.get` answering like the sql endpoint.
+    """
+
+    # Rows with the bbox columns added by the tile query. `a` straddles the
+    # four tiles of a 2 x 2 split of (0, 0, 10, 10), `b` two of them.
+    ROWS = [
+        {'amigo_id': 'a', 'geom': '01', '_tile_xmin': 4, '_tile_ymin': 4,
+         '_tile_xmax': 6, '_tile_ymax': 6},
+        {'amigo_id': 'b', 'geom': '02', '_tile_xmin': 1, '_tile_ymin': 2,
+         '_tile_xmax': 7, '_tile_ymax': 3},
+        {'amigo_id': 'c', 'geom': '03', '_tile_xmin': 8, '_tile_ymin': 8,
+         '_tile_xmax': 9, '_tile_ymax': 9},
+    ]
+
+    def fake_get(self, rows, fetches):
+        """
+        `requests.get` paginating `rows` by offset. Repeated parameters take
+        the last value, as in the server.
+        """
+
+        def get(url, params=None, **kwargs):
+            sent = requests.Request('GET', url, params=params).prepare().url
+            parsed = urlparse(sent)
+            query = dict(parse_qsl(parsed.query))
+            offset = int(query.get('offset', 0))
+            limit = int(query.get('limit', 100))
+            fetch = (query['query'], offset)
+            assert fetch not in fetches, 'page fetched twice'
+            fetches.append(fetch)
+
+            envelope = re.search(r'ST_MakeEnvelope\(([^,]+), ([^,]+), '
+                                 r'([^,]+), ([^,]+),', query['query'])
+            xmin, ymin, xmax, ymax = (float(v) for v in envelope.groups())
+            data = [dict(row) for row in rows
+                    if row['_tile_xmin'] <= xmax and row['_tile_xmax'] >= xmin
+                    and row['_tile_ymin'] <= ymax and row['_tile_ymax'] >= ymin]
+            next_url = None
+            if offset + limit < len(data):
+                next_url = 'http://fake%s?%s' % (parsed.path, urlencode(
+                    {'query': query['query'], 'offset': offset + limit,
+                     'limit': limit}))
+            return FakeResponse({'count': len(data), 'next': next_url,
+                                 'data': data[offset:offset + limit]})
+        return get
+
+    def test_tiles_deduplicated(self, monkeypatch):
+        fetches = []
+        monkeypatch.setattr(requests, 'get', self.fake_get(self.ROWS, fetches))
+        client = AmigoCloud(use_websockets=False)
+        index = client.get_spatial_index('1', '2', (0, 0, 10, 10),
+                                         geometry_field='geom', tiles=2)
+
+        queries = [query for query, offset in fetches]
+        assert len(queries) == 4
+        assert all('FROM dataset_2' in query for query in queries)
+        assert len(index) == 3
+        for row in self.ROWS:
+            key = row['amigo_id']
+            assert index.bbox(key) == (row['_tile_xmin'], row['_tile_ymin'],
+                                       row['_tile_xmax'], row['_tile_ymax'])
+            assert index[key] == {'amigo_id': key, 'geom': row['geom']}
+        assert index.nearest(9.5, 9.5) == [index['c']]
+
+    def test_tiles_paginated(self, monkeypatch):
+        # Five rows in the lower left tile, fetched two per page
+        rows = [{'amigo_id': str(i), 'geom': '01', '_tile_xmin': i,
+                 '_tile_ymin': i, '_tile_xmax': i, '_tile_ymax': i}
+                for i in range(5)]
+        fetches = []
+        monkeypatch.setattr(requests, 'get', self.fake_get(rows, fetches))
+        client = AmigoCloud(use_websockets=False)
+        index = client.get_spatial_index('1', '2', (0, 0, 10, 10),
+                                         geometry_field='geom', tiles=2,
+                                         page_size=2)
+
+        offsets = sorted(offset for query, offset in fetches)
+        # Three pages of the first tile, one of each other tile
+        assert offsets == [0, 0, 0, 0, 2, 4]
+        assert len(index) == 5
+        assert sorted(row['amigo_id'] for row in
+                      index.intersection((0, 0, 10, 10))) == \
+            [str(i) for i in range(5)]